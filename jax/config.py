@@ -21,12 +21,20 @@ class Config(object):
     self.meta = {}
     self.FLAGS = NameSpace(self.read)
     self.use_absl = False
+    self.update_hooks = {}
 
   def update(self, name, val):
     self.check_exists(name)
     if name not in self.values:
       raise Exception("Unrecognized config option: {}".format(name))
     self.values[name] = val
+    for hook in self.update_hooks.get(name, ()):
+      hook(val)
+
+  def add_update_hook(self, name, hook):
+    """Registers `hook` to be called with the new value of option `name`."""
+    self.check_exists(name)
+    self.update_hooks.setdefault(name, []).append(hook)
 
   def read(self, name):
     if self.use_absl:
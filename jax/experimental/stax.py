@@ -63,23 +63,24 @@ def fastvar(x, axis, keepdims):
 
 def randn(stddev=1e-2):
   """An initializer function for random normal coefficients."""
+  std = onp.float32(stddev)
   def init(rng, shape):
-    std = lax.convert_element_type(stddev, np.float32)
-    return std * random.normal(rng, shape, dtype=np.float32)
+    return random.normal(rng, shape, dtype=np.float32) * std
   return init
 
 def glorot(out_axis=0, in_axis=1, scale=onp.sqrt(2)):
   """An initializer function for random Glorot-scaled coefficients."""
   def init(rng, shape):
     fan_in, fan_out = shape[in_axis], shape[out_axis]
-    size = onp.prod(onp.delete(shape, [in_axis, out_axis]))
-    std = scale / np.sqrt((fan_in + fan_out) / 2. * size)
-    std = lax.convert_element_type(std, np.float32)
-    return std * random.normal(rng, shape, dtype=np.float32)
+    fan_axes = {in_axis % len(shape), out_axis % len(shape)}
+    size = reduce(op.mul,
+                  (d for i, d in enumerate(shape) if i not in fan_axes), 1)
+    std = onp.float32(scale / onp.sqrt((fan_in + fan_out) / 2. * size))
+    return random.normal(rng, shape, dtype=np.float32) * std
   return init
 
-zeros = lambda rng, shape: np.zeros(shape, dtype='float32')
-ones = lambda rng, shape: np.ones(shape, dtype='float32')
+zeros = lambda rng, shape: lax.full(shape, 0, onp.float32)
+ones = lambda rng, shape: lax.full(shape, 1, onp.float32)
 
 
 # Layers
@@ -147,14 +147,7 @@ def replica_groups(nrep, mesh_spec, mesh_axes):
       {0, 1, ..., nrep} into equally-sized replica groups (within which
       collectives are executed). XLA consumes this replica group specification.
   """
-  trailing_size, ragged = divmod(nrep, prod(mesh_spec))
-  assert not ragged
-  full_spec = mesh_spec + [trailing_size]
-  iota = onp.arange(prod(full_spec)).reshape(full_spec)
-  groups = onp.reshape(
-      onp.moveaxis(iota, mesh_axes, onp.arange(len(mesh_axes))),
-      (prod(onp.take(full_spec, mesh_axes)), -1))
-  return tuple(map(tuple, groups.T))
+  return xla._axis_groups(nrep, tuple(mesh_spec), tuple(mesh_axes))
 
 
 ### the main pmap machinery lowers SPMD jaxprs to multi-replica XLA computations
@@ -168,8 +161,7 @@ def compile_replicated(jaxpr, axis_name, axis_size, consts, *abstract_args):
   axis_env = xla.AxisEnv(num_replicas, [axis_name], [axis_size])
   arg_shapes = list(map(aval_to_xla_shape, abstract_args))
   built_c = xla.jaxpr_computation(jaxpr, axis_env, consts, (), *arg_shapes)
-  compiled = built_c.Compile(arg_shapes, xb.get_compile_options(num_replicas),
-                             backend=xb.get_backend())
+  compiled = xb.compile_computation(built_c, arg_shapes, num_replicas)
   return compiled, num_replicas
 
 
@@ -399,7 +391,7 @@ def xla_pmap_impl(fun, *args, **params):
   compiled_fun = parallel_callable(fun, axis_name, axis_size, *abstract_args)
   return compiled_fun(*args)
 
-@lu.cache
+@partial(lu.cache, max_size=xb.COMPILE_CACHE_SIZE)
 def parallel_callable(fun, axis_name, axis_size, *avals):
   avals = tuple(map(partial(shard_aval, axis_size), avals))
   pvals = [PartialVal((aval, core.unit)) for aval in avals]
@@ -472,9 +464,9 @@ def _xla_pmap_translation_rule(c, jaxpr, axis_env, env_nodes, in_nodes,
                                axis_name, axis_size):
   new_env = xla.extend_axis_env(axis_env, axis_name, axis_size)
   in_nodes_sharded = list(map(partial(_xla_shard, c, new_env.sizes), in_nodes))
-  subc = xla.jaxpr_computation(jaxpr, new_env, (),
-                               tuple(map(c.GetShape, env_nodes)),
-                               *map(c.GetShape, in_nodes_sharded))
+  subc = xla.jaxpr_subcomputation(c, jaxpr, new_env,
+                                  tuple(map(c.GetShape, env_nodes)),
+                                  *map(c.GetShape, in_nodes_sharded))
   sharded_result = c.Call(subc, env_nodes + in_nodes_sharded)
   sharded_results = xla.xla_destructure(c, sharded_result)
   unsharded_results = [_xla_unshard(c, xla.axis_groups(new_env, axis_name), r)
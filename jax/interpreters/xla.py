@@ -16,7 +16,7 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
-from collections import namedtuple, defaultdict
+from collections import namedtuple, defaultdict, OrderedDict
 from distutils.util import strtobool
 import itertools as it
 import operator as op
@@ -44,6 +44,10 @@ FLAGS = flags.FLAGS
 flags.DEFINE_bool('jax_debug_nans',
                   strtobool(os.getenv('JAX_DEBUG_NANS', "False")),
                   'Add nan checks to every operation.')
+flags.DEFINE_bool('jax_check_shapes',
+                  strtobool(os.getenv('JAX_CHECK_SHAPES', "True")),
+                  'Have XLA check the shape of every operation as it is staged '
+                  'out, for better error messages.')
 
 def _map(f, *xs): return tuple(map(f, *xs))
 def identity(x): return x
@@ -54,8 +58,11 @@ def identity(x): return x
 xb.register_constant_handler(core.Unit, lambda c, *_: c.Tuple())
 
 def aval_to_xla_shape(aval):
+  t = type(aval)
+  if t is ShapedArray or t is ConcreteArray:
+    return xc.Shape.array_shape(aval.dtype, aval.shape)  # inlined common case
   try:
-    return xla_shape_handlers[type(aval)](aval)
+    return xla_shape_handlers[t](aval)
   except KeyError:
     raise TypeError("No xla_shape_handler for type: {}".format(type(aval)))
 xla_shape_handlers = {}
@@ -75,12 +82,88 @@ xla_result_handlers[ShapedArray] = array_result_handler
 xla_result_handlers[ConcreteArray] = array_result_handler
 
 def device_put(x, device_num=0):
-  x = canonicalize_dtype(x)
+  return _get_device_put_handler(type(x))(x, device_num)
+
+def _get_device_put_handler(t):
+  try:
+    return _combined_device_put_handlers[t]
+  except KeyError:
+    put = _combined_device_put_handlers[t] = _device_put_handler(t)
+    return put
+
+def _device_put_handler(t):
+  # fuse the canonicalize_dtype and device_put handlers for type t, so that
+  # device_put does a single type dispatch
+  try:
+    canonicalize = canonicalize_dtype_handlers[t]
+  except KeyError:
+    raise TypeError("No canonicalize_dtype handler for type: {}".format(t))
+  if canonicalize is identity:
+    try:
+      return device_put_handlers[t]
+    except KeyError:
+      raise TypeError("No device_put handler for type: {}".format(t))
+  elif canonicalize is _canonicalize_ndarray_dtype:
+    put = device_put_handlers[onp.ndarray]
+    return lambda x, n: put(canonicalize(x), n)
+  else:
+    return partial(_device_put_canonicalized, canonicalize)
+
+def _device_put_canonicalized(canonicalize, x, device_num):
+  x = canonicalize(x)
   try:
     return device_put_handlers[type(x)](x, device_num)
   except KeyError:
     raise TypeError("No device_put handler for type: {}".format(type(x)))
-device_put_handlers = {}
+
+class _InvalidatingTable(dict):
+  """A handler table that calls `_invalidate` before every mutation."""
+  __slots__ = []
+
+  def _invalidate(self):
+    raise NotImplementedError
+
+  def __setitem__(self, key, value):
+    self._invalidate()
+    dict.__setitem__(self, key, value)
+
+  def __delitem__(self, key):
+    self._invalidate()
+    dict.__delitem__(self, key)
+
+  def update(self, *args, **kwargs):
+    self._invalidate()
+    dict.update(self, *args, **kwargs)
+
+  def setdefault(self, key, default=None):
+    self._invalidate()
+    return dict.setdefault(self, key, default)
+
+  def pop(self, key, *default):
+    self._invalidate()
+    return dict.pop(self, key, *default)
+
+  def popitem(self):
+    self._invalidate()
+    return dict.popitem(self)
+
+  def clear(self):
+    self._invalidate()
+    dict.clear(self)
+
+  def __ior__(self, other):
+    self._invalidate()
+    return dict.__ior__(self, other)
+
+class _DevicePutTable(_InvalidatingTable):
+  """A handler table that invalidates the fused device_put handlers."""
+  __slots__ = []
+
+  def _invalidate(self):
+    _combined_device_put_handlers.clear()
+
+_combined_device_put_handlers = {}
+device_put_handlers = _DevicePutTable()
 device_put_handlers[core.Unit] = \
     lambda _, n: xc.Buffer.from_pyval((), n, backend=xb.get_backend())
 def _device_put_array(x, n):
@@ -94,10 +177,13 @@ def canonicalize_dtype(x):
     return canonicalize_dtype_handlers[type(x)](x)
   except KeyError:
     raise TypeError("No canonicalize_dtype handler for type: {}".format(type(x)))
-canonicalize_dtype_handlers = {}
+canonicalize_dtype_handlers = _DevicePutTable()
 canonicalize_dtype_handlers[core.Unit] = identity
 def _canonicalize_ndarray_dtype(x):
-  return onp.asarray(x, xb.canonicalize_dtype(onp.result_type(x)))
+  dtype = xb.canonicalize_dtype(onp.result_type(x))
+  if type(x) is onp.ndarray and x.dtype == dtype:
+    return x
+  return onp.asarray(x, dtype)
 for _t in array_types:
   canonicalize_dtype_handlers[_t] = _canonicalize_ndarray_dtype
 
@@ -116,11 +202,23 @@ for _t in array_types:
 
 def apply_primitive(prim, *args, **params):
   """Impl rule that compiles and runs a single primitive 'prim' using XLA."""
-  abstract_args = map(abstractify, args)
+  # inline abstractify, specializing for the common unary and binary cases
+  try:
+    if len(args) == 1:
+      x, = args
+      abstract_args = (pytype_aval_mappings[type(x)](x),)
+    elif len(args) == 2:
+      x, y = args
+      abstract_args = (pytype_aval_mappings[type(x)](x),
+                       pytype_aval_mappings[type(y)](y))
+    else:
+      abstract_args = [pytype_aval_mappings[type(x)](x) for x in args]
+  except KeyError:
+    abstract_args = _map(abstractify, args)  # raises an informative TypeError
   compiled_fun = xla_primitive_callable(prim, *abstract_args, **params)
   return compiled_fun(*args)
 
-@cache()
+@cache(xb.COMPILE_CACHE_SIZE)
 def xla_primitive_callable(prim, *abstract_args, **params):
   aval_out = prim.abstract_eval(*abstract_args, **params)
   if prim.multiple_results:
@@ -130,8 +228,7 @@ def xla_primitive_callable(prim, *abstract_args, **params):
     handle_result = aval_to_result_handler(aval_out)
   xla_shapes = tuple(map(aval_to_xla_shape, abstract_args))
   built_c = primitive_computation(prim, *xla_shapes, **params)
-  compiled = built_c.Compile(xla_shapes, xb.get_compile_options(),
-                             backend=xb.get_backend())
+  compiled = xb.compile_computation(built_c, xla_shapes)
   return partial(_execute_compiled_primitive, prim, compiled, handle_result)
 
 @cache()
@@ -139,14 +236,10 @@ def primitive_computation(prim, *xla_shapes, **params):
   c = xb.make_computation_builder("primitive_computation")
   platform = xb.get_backend().platform
   xla_args = map(c.ParameterWithShape, xla_shapes)
-  if prim in backend_specific_translations[platform]:
-    rule = backend_specific_translations[platform][prim]
+  kind, rule = _merge_translations(platform).get(prim, (None, None))
+  if kind == _TRANSLATION:
     rule(c, *xla_args, **params)  # return val set as a side-effect on c
-  elif prim in translations:
-    rule = translations[prim]
-    rule(c, *xla_args, **params)  # return val set as a side-effect on c
-  elif prim in initial_style_translations:
-    rule = initial_style_translations[prim]
+  elif kind == _INITIAL_STYLE:
     rule(c, AxisEnv(1, [], []), *xla_args, **params)  # side-effect on c
   else:
     raise NotImplementedError("XLA translation rule for {} not found".format(prim))
@@ -171,12 +264,17 @@ def check_nans(prim, buf):
   else:
     _check_nans(prim.name, buf.shape(), buf)
 
+_NAN_CHECK_CHUNK_SIZE = 1 << 20
+
 def _check_nans(name, xla_shape, buf):
   if xla_shape.is_tuple():
     assert not xla_shape.tuple_shapes()
-  else:
-    if onp.issubdtype(xla_shape.element_type(), onp.floating):
-      if onp.any(onp.isnan(buf.to_py())):
+  elif onp.issubdtype(xla_shape.element_type(), onp.floating):
+    # scan in chunks so that we stop at the first nan and never materialize a
+    # boolean mask the size of the whole buffer
+    flat = buf.to_py().ravel()
+    for start in xrange(0, flat.size, _NAN_CHECK_CHUNK_SIZE):
+      if onp.isnan(flat[start:start + _NAN_CHECK_CHUNK_SIZE]).any():
         msg = "invalid value (nan) encountered in {}"
         raise FloatingPointError(msg.format(name))
 
@@ -190,9 +288,9 @@ def compile_jaxpr(jaxpr, device_assignment, axis_env, const_vals, *abstract_args
     raise ValueErrr(msg.format(axis_env.nreps, xb.device_count()))
   arg_shapes = tuple(map(aval_to_xla_shape, abstract_args))
   built_c = jaxpr_computation(jaxpr, axis_env, const_vals, (), *arg_shapes)
-  compile_opts = xb.get_compile_options(num_replicas=axis_env.nreps,
-                                        device_assignment=device_assignment)
-  return built_c.Compile(arg_shapes, compile_opts, backend=xb.get_backend())
+  return xb.compile_computation(built_c, arg_shapes,
+                                num_replicas=axis_env.nreps,
+                                device_assignment=device_assignment)
 
 def build_jaxpr(jaxpr, axis_env, const_vals, *abstract_args):
   arg_shapes = map(aval_to_xla_shape, abstract_args)
@@ -204,7 +302,9 @@ def prefetch(x):
   return x
 
 def jaxpr_literals(jaxpr):
-  return it.chain.from_iterable(eqn_literals(eqn) for eqn in jaxpr.eqns)
+  for eqn in jaxpr.eqns:
+    for literal in eqn_literals(eqn):
+      yield literal
 
 def eqn_literals(eqn):
   if eqn.bound_subjaxprs:
@@ -226,14 +326,93 @@ def jaxpr_computation(jaxpr, axis_env, const_vals, freevar_shapes, *arg_shapes):
                                     *arg_shapes)
   return c.Build(c.Tuple(*out_nodes))
 
+def jaxpr_subcomputation(c, jaxpr, axis_env, freevar_shapes, *arg_shapes):
+  """Like jaxpr_computation, but reuses computations already built for `c`.
+
+  Call translation rules use this so that a subjaxpr called several times with
+  the same shapes from within one computation is lowered only once. Subjaxprs
+  are matched by structure, since e.g. each call of a jitted function while
+  tracing produces a new but identical jaxpr.
+  """
+  key = (_jaxpr_fingerprint(jaxpr), axis_env.nreps, tuple(axis_env.names),
+         tuple(axis_env.sizes), tuple(freevar_shapes), arg_shapes)
+  subcomputations = c._subcomputation_cache
+  try:
+    _, subc = subcomputations[key]
+  except KeyError:
+    subc = jaxpr_computation(jaxpr, axis_env, (), freevar_shapes, *arg_shapes)
+    # keep the jaxpr alive alongside the entry, so that objects its fingerprint
+    # refers to by id can't be freed and their ids reused
+    subcomputations[key] = (jaxpr, subc)
+  return subc
+
+def _jaxpr_fingerprint(jaxpr):
+  """Returns a hashable key that is equal for structurally equal jaxprs."""
+  var_nums = {}
+  def var(v):
+    if type(v) is Literal:
+      return ('literal', _value_fingerprint(v.val))
+    elif v is core.unitvar:
+      return '*'
+    try:
+      return var_nums[v]
+    except KeyError:
+      num = var_nums[v] = len(var_nums)
+      return num
+
+  binders = (tuple(map(var, jaxpr.constvars)), tuple(map(var, jaxpr.freevars)),
+             tuple(map(var, jaxpr.invars)))
+  eqns = []
+  for eqn in jaxpr.eqns:
+    invars = tuple(map(var, eqn.invars))
+    subjaxprs = tuple((_jaxpr_fingerprint(subjaxpr),
+                       tuple(map(var, const_bindings)),
+                       tuple(map(var, freevar_bindings)))
+                      for subjaxpr, const_bindings, freevar_bindings
+                      in eqn.bound_subjaxprs)
+    params = tuple((name, _value_fingerprint(eqn.params[name]))
+                   for name in sorted(eqn.params))
+    eqns.append((eqn.primitive, invars, subjaxprs, params,
+                 tuple(map(var, eqn.outvars))))
+  return binders, tuple(eqns), tuple(map(var, jaxpr.outvars))
+
+def _value_fingerprint(val):
+  t = type(val)
+  if t in _exact_fingerprint_types:
+    return (t, val)
+  elif t in (float, complex):
+    return (t, repr(val))  # distinguishes e.g. 0. and -0.
+  elif t in (tuple, list):
+    return (t,) + tuple(map(_value_fingerprint, val))
+  elif isinstance(val, onp.dtype):
+    return (onp.dtype, val)
+  elif isinstance(val, (onp.ndarray, onp.generic)):
+    key = xb.constant_cache_key(val)
+    if key is not None:
+      return key
+  # anything else is compared by identity
+  return (id(val),)
+_exact_fingerprint_types = ({bool, type(None), str, six.text_type}
+                            | set(six.integer_types))
+
 def _jaxpr_computation(jaxpr, axis_env, const_vals, freevar_shapes, *arg_shapes):
   c = xb.make_computation_builder("jaxpr_computation")
   platform = xb.get_backend().platform
-  _map(prefetch, it.chain(jaxpr_literals(jaxpr), const_vals))
+  prefetched = set()
+  for x in it.chain(jaxpr_literals(jaxpr), const_vals):
+    if id(x) not in prefetched:
+      prefetched.add(id(x))
+      prefetch(x)
 
+  literal_nodes = {}
   def read(v):
     if type(v) is Literal:
-      return c.Constant(canonicalize_dtype(v.val))
+      # the builder dedups small constants by value; literals are kept alive by
+      # the jaxpr, so their ids are stable keys for the rest
+      node = literal_nodes.get(id(v.val))
+      if node is None:
+        node = literal_nodes[id(v.val)] = c.Constant(canonicalize_dtype(v.val))
+      return node
     else:
       return env[v]
 
@@ -250,33 +429,36 @@ def _jaxpr_computation(jaxpr, axis_env, const_vals, freevar_shapes, *arg_shapes)
     all_freevars = it.chain(jaxpr.constvars, jaxpr.freevars)
     _map(write, all_freevars, map(c.ParameterWithShape, freevar_shapes))
   _map(write, jaxpr.invars, map(c.ParameterWithShape, arg_shapes))
+  dispatch = _merge_translations(platform)
+  check_shapes = FLAGS.jax_check_shapes
   for eqn in jaxpr.eqns:
-    in_nodes = list(map(read, eqn.invars))
-    if eqn.primitive in backend_specific_translations[platform]:
-      rule = backend_specific_translations[platform][eqn.primitive]
+    in_nodes = [read(v) if type(v) is Literal else env[v] for v in eqn.invars]
+    try:
+      kind, rule = dispatch[eqn.primitive]
+    except KeyError:
+      msg = "XLA translation rule for primitive '{}' not found"
+      raise NotImplementedError(msg.format(eqn.primitive.name))
+    if kind == _TRANSLATION:
       ans = rule(c, *in_nodes, **eqn.params)
-    elif eqn.primitive in translations:
-      ans = translations[eqn.primitive](c, *in_nodes, **eqn.params)
-    elif eqn.primitive in initial_style_translations:
-      rule = initial_style_translations[eqn.primitive]
+    elif kind == _INITIAL_STYLE:
       ans = rule(c, axis_env, *in_nodes, **eqn.params)
-    elif eqn.primitive in parallel_translations:
+    elif kind == _PARALLEL:
       replica_groups = axis_groups(axis_env, eqn.params['axis_name'])
       new_params = {k: eqn.params[k] for k in eqn.params if k != 'axis_name'}
-      rule = parallel_translations[eqn.primitive]
       ans = rule(c, *in_nodes, replica_groups=replica_groups, **new_params)
-    elif eqn.primitive in call_translations:
+    else:
       (subjaxpr, const_bindings, freevar_bindings), = eqn.bound_subjaxprs
       env_nodes = list(map(read, const_bindings + freevar_bindings))
-      rule = call_translations[eqn.primitive]
       ans = rule(c, subjaxpr, axis_env, env_nodes, in_nodes, **eqn.params)
-    else:
-      msg = "XLA translation rule for primitive '{}' not found"
-      raise NotImplementedError(msg.format(eqn.primitive.name))
 
-    c.GetShape(ans)  # force xla to do shape error checking
-    out_nodes = xla_destructure(c, ans) if eqn.primitive.multiple_results else [ans]
-    _map(write, eqn.outvars, out_nodes)
+    if check_shapes:
+      c.GetShape(ans)  # force xla to do shape error checking
+    assert ans is not None
+    if eqn.primitive.multiple_results:
+      for v, node in zip(eqn.outvars, xla_destructure(c, ans)):
+        env[v] = node
+    else:
+      env[eqn.outvars[0]] = ans
   return c, _map(read, jaxpr.outvars)
 
 def xla_destructure(c, ans):
@@ -290,39 +472,61 @@ def extend_axis_env(env, name, size):
   return AxisEnv(env.nreps, env.names + [name], env.sizes + [size])
 
 def axis_read(axis_env, axis_name):
-  return max(i for i, name in enumerate(axis_env.names) if name == axis_name)
+  names = axis_env.names
+  for i in xrange(len(names) - 1, -1, -1):
+    if names[i] == axis_name:
+      return i
+  raise NameError("unbound axis name: {}".format(axis_name))
 
 def axis_groups(axis_env, name):
   if isinstance(name, (list, tuple)):
     mesh_axes = tuple(map(partial(axis_read, axis_env), name))
   else:
     mesh_axes = (axis_read(axis_env, name),)
-  return _axis_groups(axis_env.nreps, axis_env.sizes, mesh_axes)
+  return _axis_groups(axis_env.nreps, tuple(axis_env.sizes), mesh_axes)
 
+@cache()
 def _axis_groups(nrep, mesh_spec, mesh_axes):
   trailing_size, ragged = divmod(nrep, prod(mesh_spec))
   assert not ragged
   full_spec = list(mesh_spec) + [trailing_size]
-  iota = onp.arange(prod(full_spec)).reshape(full_spec)
-  groups = onp.reshape(
-      onp.moveaxis(iota, mesh_axes, onp.arange(len(mesh_axes))),
-      (prod(onp.take(full_spec, mesh_axes)), -1))
-  return tuple(map(tuple, groups.T))
+  # Rather than materializing an iota over the full mesh and moving the mesh
+  # axes to the front, build the flat replica ids of each group directly from
+  # the row-major strides: a group is indexed by its coordinates along the
+  # non-mesh axes, and its members by their coordinates along the mesh axes.
+  strides = [prod(full_spec[i+1:]) for i in range(len(full_spec))]
+  other_axes = [i for i in range(len(full_spec)) if i not in mesh_axes]
+  groups = onp.add.outer(_raveled_offsets(full_spec, strides, other_axes),
+                         _raveled_offsets(full_spec, strides, mesh_axes))
+  return tuple(map(tuple, groups.tolist()))
+
+def _raveled_offsets(spec, strides, axes):
+  offsets = onp.zeros(1, dtype=onp.int64)
+  for ax in axes:
+    steps = onp.arange(spec[ax], dtype=onp.int64) * strides[ax]
+    offsets = onp.add.outer(offsets, steps).ravel()
+  return offsets
 
 def jaxpr_replicas(jaxpr):
-  return max(it.chain([1], (eqn_replicas(eqn) for eqn in jaxpr.eqns)))
-
-def eqn_replicas(eqn):
-  if eqn.bound_subjaxprs:
-    (subjaxpr, _, _), = eqn.bound_subjaxprs
-    return eqn.params.get('axis_size', 1) * jaxpr_replicas(subjaxpr)
-  elif eqn.primitive in initial_style_translations:
-    nums = (jaxpr_replicas(param if type(param) is core.Jaxpr else param.jaxpr)
-            for param in eqn.params.values()
-            if type(param) in (core.Jaxpr, core.TypedJaxpr))
-    return max(it.chain([1], nums))
-  else:
-    return 1
+  # Each (sub)jaxpr needs at least as many replicas as the product of the
+  # axis sizes of the maps enclosing it, so we walk all subjaxprs with an
+  # explicit stack, tracking that product, and take the max.
+  num_replicas = 1
+  stack = [(jaxpr, 1)]
+  while stack:
+    jaxpr, multiplier = stack.pop()
+    num_replicas = max(num_replicas, multiplier)
+    for eqn in jaxpr.eqns:
+      if eqn.bound_subjaxprs:
+        (subjaxpr, _, _), = eqn.bound_subjaxprs
+        stack.append((subjaxpr, multiplier * eqn.params.get('axis_size', 1)))
+      elif eqn.primitive in initial_style_translations:
+        for param in eqn.params.values():
+          if type(param) is core.Jaxpr:
+            stack.append((param, multiplier))
+          elif type(param) is core.TypedJaxpr:
+            stack.append((param.jaxpr, multiplier))
+  return num_replicas
 
 
 ### xla_call underlying jit
@@ -337,7 +541,7 @@ def _xla_call_impl(fun, *args, **params):
           "Calling the de-optimized version.")
     return fun.call_wrapped(*args)  # probably won't return
 
-@lu.cache
+@partial(lu.cache, max_size=xb.COMPILE_CACHE_SIZE)
 def _xla_callable(fun, device_assignment, *abstract_args):
   pvals = [pe.PartialVal((aval, core.unit)) for aval in abstract_args]
   with core.new_master(pe.JaxprTrace, True) as master:
@@ -368,7 +572,9 @@ def _execute_compiled(compiled, handlers, *args):
   return [handler(out_buf) for handler, out_buf in zip(handlers, out_bufs)]
 
 def _execute_replicated(compiled, handlers, *args):
-  input_bufs = [[device_put(x, i) for x in args]
+  # look up each argument's handler once rather than once per replica
+  puts = [_get_device_put_handler(type(x)) for x in args]
+  input_bufs = [[put(x, i) for put, x in zip(puts, args)]
                 for i in compiled.DeviceOrdinals()]
   out_bufs = compiled.ExecutePerReplica(input_bufs)[0].destructure()
   if FLAGS.jax_debug_nans: check_nans(xla_call_p, out_buf)
@@ -384,19 +590,47 @@ xla_call_p.def_impl(_xla_call_impl)
 def _xla_call_translation_rule(c, jaxpr, axis_env, env_nodes, in_nodes,
                                device_assignment):
   del device_assignment  # Ignored.
-  subc = jaxpr_computation(jaxpr, axis_env, (), _map(c.GetShape, env_nodes),
-                           *map(c.GetShape, in_nodes))
+  subc = jaxpr_subcomputation(c, jaxpr, axis_env, _map(c.GetShape, env_nodes),
+                              *map(c.GetShape, in_nodes))
   return c.Call(subc, env_nodes + in_nodes)
 ad.primitive_transposes[xla_call_p] = partial(ad.call_transpose, xla_call_p)
 
 
 ### translation tables
 
-translations = {}
-parallel_translations = {}
-initial_style_translations = {}
-call_translations = {}
-backend_specific_translations = defaultdict(dict)
+class _TranslationTable(_InvalidatingTable):
+  """A rule table that invalidates the merged dispatch tables when updated."""
+  __slots__ = []
+
+  def _invalidate(self):
+    _dispatch_tables.clear()
+
+translations = _TranslationTable()
+parallel_translations = _TranslationTable()
+initial_style_translations = _TranslationTable()
+call_translations = _TranslationTable()
+backend_specific_translations = defaultdict(_TranslationTable)
+
+# Rule kinds in the merged dispatch tables, which map each primitive to a
+# (kind, rule) pair so that lowering an eqn takes a single dict lookup.
+_TRANSLATION, _INITIAL_STYLE, _PARALLEL, _CALL = range(4)
+_dispatch_tables = {}
+
+def _merge_translations(platform):
+  try:
+    return _dispatch_tables[platform]
+  except KeyError:
+    # later tables take precedence, matching the lookup order used to lower eqns
+    table = {}
+    backend_translations = backend_specific_translations[platform]
+    for kind, rules in [(_CALL, call_translations),
+                        (_PARALLEL, parallel_translations),
+                        (_INITIAL_STYLE, initial_style_translations),
+                        (_TRANSLATION, translations),
+                        (_TRANSLATION, backend_translations)]:
+      table.update((prim, (kind, rule)) for prim, rule in rules.items())
+    _dispatch_tables[platform] = table
+    return table
 
 translations[core.identity_p] = lambda c, x: x
 call_translations[xla_call_p] = _xla_call_translation_rule
@@ -471,6 +705,8 @@ def _forward_method(attrname, self, fun, *args):
   return fun(getattr(self, attrname), *args)
 _forward_to_value = partial(_forward_method, "_value")
 
+_MAX_NPY_CACHE_BYTES = 1 << 20
+
 class DeviceArray(DeviceValue):
   """A DeviceArray is an ndarray backed by a single device memory buffer."""
   # We don't subclass ndarray because that would open up a host of issues,
@@ -483,16 +719,23 @@ class DeviceArray(DeviceValue):
     self.device_buffer = device_buffer
     self._npy_value = None
     if not core.skip_checks:
-      npy_value = self._value
-      assert npy_value.dtype == aval.dtype and npy_value.shape == aval.shape
+      # check against the buffer's metadata to avoid a transfer to the host
+      xla_shape = device_buffer.shape()
+      assert (xla_shape.element_type() == aval.dtype and
+              tuple(xla_shape.dimensions()) == aval.shape)
 
   @property
   def _value(self):
     self._check_if_deleted()
-    if self._npy_value is None:
-      self._npy_value = self.device_buffer.to_py()
-      self._npy_value.flags.writeable = False
-    return self._npy_value
+    if self._npy_value is not None:
+      return self._npy_value
+    npy_value = self.device_buffer.to_py()
+    npy_value.flags.writeable = False
+    # only keep small host copies alive, so that inspecting a large array once
+    # doesn't pin a host copy for the lifetime of the DeviceArray
+    if npy_value.nbytes <= _MAX_NPY_CACHE_BYTES:
+      self._npy_value = npy_value
+    return npy_value
 
   @property
   def shape(self):
@@ -635,6 +878,16 @@ ad.deflinear(device_put_p, lambda cotangent, **kwargs: [cotangent])
 class DeviceConstant(DeviceArray):
   def copy_to_host_async(self): pass
 
+  @property
+  def cache_key(self):
+    """A hashable key for the constant's parameters other than its aval.
+
+    Constants with equal types, avals and cache keys must stage out equal XLA
+    constants, so that the executables that instantiate them can be shared. A
+    key of None disables that sharing.
+    """
+    return None
+
   @staticmethod
   def constant_handler(c, constant_instance, canonicalize_types=True):
     assert False
@@ -644,10 +897,26 @@ def _instantiate_device_constant(const, device_num=0, cutoff=1e6):
   # large, or alternatively build it on the host and transfer it if it's small
   assert isinstance(const, DeviceConstant)
   if const.size > cutoff and device_num == 0:
-    c = xb.make_computation_builder("constant_instantiating_computation")
-    xla_const = const.constant_handler(c, const)
-    opts = xb.get_compile_options(device_assignment=(device_num,))
-    compiled = c.Build(xla_const).Compile((), opts, backend=xb.get_backend())
+    key = const.cache_key
+    if key is None or xb.COMPILE_CACHE_SIZE == 0:
+      compiled = _compile_device_constant(const, device_num)
+    else:
+      key = (type(const), tuple(const.aval.shape), const.aval.dtype, key)
+      try:
+        # pop and reinsert to mark the entry as most recently used
+        compiled = _device_constant_executables.pop(key)
+      except KeyError:
+        compiled = _compile_device_constant(const, device_num)
+        if len(_device_constant_executables) >= xb.COMPILE_CACHE_SIZE:
+          _device_constant_executables.popitem(last=False)
+      _device_constant_executables[key] = compiled
     return compiled.Execute(())
   else:
     return xc.Buffer.from_pyval(onp.asarray(const), device_num)
+_device_constant_executables = OrderedDict()
+
+def _compile_device_constant(const, device_num):
+  c = xb.make_computation_builder("constant_instantiating_computation")
+  xla_const = const.constant_handler(c, const)
+  opts = xb.get_compile_options(device_assignment=(device_num,))
+  return c.Build(xla_const).Compile((), opts, backend=xb.get_backend())
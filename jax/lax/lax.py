@@ -3962,6 +3962,10 @@ class _FilledConstant(xla.DeviceConstant):
   def _value(self):
     return onp.full(self.shape, self.fill_value)
 
+  @property
+  def cache_key(self):
+    return self.fill_value.tobytes()
+
   @staticmethod
   def constant_handler(c, filled_const, canonicalize_types=True):
     return c.Broadcast(
@@ -3987,6 +3991,10 @@ class _IotaConstant(xla.DeviceConstant):
       self._npy_value = onp.broadcast_to(iota, self.shape)
     return self._npy_value
 
+  @property
+  def cache_key(self):
+    return self.axis
+
   @staticmethod
   def constant_handler(c, iota_constant, canonicalize_types=True):
     dtype = iota_constant.dtype
@@ -4015,6 +4023,10 @@ class _EyeConstant(xla.DeviceConstant):
       self._npy_value = onp.broadcast_to(result, self.shape)
     return self._npy_value
 
+  @property
+  def cache_key(self):
+    return tuple(self.axes)
+
   @staticmethod
   def constant_handler(c, diag_const, canonicalize_types=True):
     if canonicalize_types:
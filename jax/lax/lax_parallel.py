@@ -188,6 +188,8 @@ def _allreduce_split_axis_rule(prim, reducer, vals, which_mapped, axis_name):
   return prim.bind(reducer(x, [0]), axis_name=axis_name), False
 
 def _allreduce_translation_rule(prim, c, val, replica_groups):
+  if len(replica_groups[0]) == 1:
+    return val  # reducing over singleton groups is the identity
   dtype = c.GetShape(val).numpy_dtype()
   scalar = xla_client.Shape.array_shape(dtype, ())
   computation = xla.primitive_computation(prim, scalar, scalar)
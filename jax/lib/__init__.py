@@ -38,7 +38,6 @@ _check_jaxlib_version()
 
 
 from jaxlib import xla_client
-from jaxlib import xrt
 from jaxlib import lapack
 
 # TODO(phawkins): make the import unconditional when the minimum Jaxlib version
@@ -23,18 +23,19 @@ from __future__ import absolute_import
 from __future__ import division
 from __future__ import print_function
 
+import hashlib
 import os
 import warnings
 from distutils.util import strtobool
+from functools import partial
 
 from ..config import flags
 from .. import util
 import numpy as onp  # 'onp' rather than 'np' to distinguish from autograd.numpy
-import six
 import threading
 
+from . import jaxlib_version
 from . import xla_client
-from . import xrt
 
 FLAGS = flags.FLAGS
 flags.DEFINE_bool('jax_enable_x64',
@@ -52,6 +53,11 @@ flags.DEFINE_string(
     'Platform name for XLA. The default is to attempt to use a GPU if '
     'available, but fall back to CPU otherwise. To set the platform manually, '
     'pass "cpu" for CPU or "gpu" for GPU.')
+flags.DEFINE_string(
+    'jax_compilation_cache_dir',
+    os.getenv('JAX_COMPILATION_CACHE_DIR', ''),
+    'Directory in which to persist compiled XLA executables across processes, '
+    'for backends that support serializing them. Disabled if empty.')
 
 
 def get_compile_options(num_replicas=None, device_assignment=None):
@@ -83,6 +89,105 @@ def get_compile_options(num_replicas=None, device_assignment=None):
     compile_options.device_assignment = device_assignment
   return compile_options
 
+def _compile_cache_size():
+  value = os.getenv('JAX_COMPILE_CACHE_SIZE', '4096')
+  try:
+    size = int(value)
+  except ValueError:
+    size = -1
+  if size < 0:
+    msg = 'JAX_COMPILE_CACHE_SIZE must be a non-negative integer, got {!r}.'
+    raise ValueError(msg.format(value))
+  return size
+
+# Maximum number of compiled executables kept by each of the in-memory
+# compilation caches (for op-by-op primitives, jit, pmap and device constants).
+# Entries are evicted least recently used first, and 0 disables caching.
+COMPILE_CACHE_SIZE = _compile_cache_size()
+
+def compile_computation(built_c, arg_shapes, num_replicas=None,
+                        device_assignment=None):
+  """Compiles an XLA Computation for the current backend.
+
+  If FLAGS.jax_compilation_cache_dir is set and the backend can serialize
+  executables, compiled executables are persisted in that directory, keyed on
+  the computation's HLO and compile options, and reused by later processes.
+
+  Args:
+    built_c: the built XLA Computation to compile.
+    arg_shapes: sequence of XLA Shapes of the computation's parameters.
+    num_replicas: as in `get_compile_options`.
+    device_assignment: as in `get_compile_options`.
+
+  Returns:
+    A compiled executable.
+  """
+  global _warned_cache_unsupported
+  compile_options = get_compile_options(num_replicas, device_assignment)
+  backend = get_backend()
+  cache_dir = FLAGS.jax_compilation_cache_dir
+  if not cache_dir:
+    return built_c.Compile(arg_shapes, compile_options, backend=backend)
+  if not (hasattr(backend, 'serialize_executable')
+          and hasattr(backend, 'deserialize_executable')):
+    if not _warned_cache_unsupported:
+      _warned_cache_unsupported = True
+      warnings.warn('jax_compilation_cache_dir is set, but the {} backend '
+                    'can\'t serialize executables; the compilation cache is '
+                    'disabled.'.format(backend.platform))
+    return built_c.Compile(arg_shapes, compile_options, backend=backend)
+
+  key = _compilation_cache_key(built_c, arg_shapes, num_replicas,
+                               device_assignment, backend)
+  path = os.path.join(cache_dir, key + '.xlabin')
+  try:
+    with open(path, 'rb') as f:
+      serialized = f.read()
+  except (IOError, OSError):
+    serialized = None  # not cached yet
+  if serialized is not None:
+    try:
+      return backend.deserialize_executable(serialized, compile_options)
+    except Exception as e:  # pylint: disable=broad-except
+      # a stale or corrupt entry is recompiled and overwritten below
+      warnings.warn('Failed to load compilation cache entry {}, recompiling: '
+                    '{}'.format(path, e))
+  compiled = built_c.Compile(arg_shapes, compile_options, backend=backend)
+  _write_cache_file(path, backend.serialize_executable(compiled))
+  return compiled
+_warned_cache_unsupported = False
+
+def _compilation_cache_key(built_c, arg_shapes, num_replicas,
+                           device_assignment, backend):
+  # An executable is only valid for the same program and compile options on
+  # the same kind of devices, compiled by the same jaxlib (and XLA) version.
+  device_spec = (backend.platform, getattr(backend, 'platform_version', None),
+                 backend.device_count())
+  hasher = hashlib.sha256()
+  # not the HLO text, which elides the contents of large constants
+  hasher.update(built_c.GetSerializedProto())
+  for part in [arg_shapes, num_replicas, device_assignment, device_spec,
+               jaxlib_version.__version__]:
+    hasher.update(repr(part).encode('utf-8'))
+  return hasher.hexdigest()
+
+def _write_cache_file(path, contents):
+  try:
+    os.makedirs(os.path.dirname(path))
+  except OSError:
+    pass  # already exists
+  # write to a temporary file and rename it so that concurrent readers never
+  # see a partially written executable
+  tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+  try:
+    with open(tmp_path, 'wb') as f:
+      f.write(contents)
+    os.rename(tmp_path, path)
+  except (IOError, OSError) as e:
+    warnings.warn('Failed to write compilation cache entry {}: {}'
+                  .format(path, e))
+
+
 _backends = {}
 
 def register_backend(name, factory):
@@ -111,6 +216,8 @@ def _get_local_backend():
   return backend
 
 def _get_xrt_backend():
+  # imported here since the XRT client is only needed by this backend
+  from jaxlib import xrt
   # TODO(phawkins): support non-TPU devices.
   tf_device_name = "TPU"
   worker = "tpu_worker"
@@ -123,19 +230,31 @@ register_backend('xla', _get_local_backend)
 register_backend('xrt', _get_xrt_backend)
 
 _backend_lock = threading.Lock()
+_backend = None
 
-@util.memoize
 def get_backend():
+  global _backend
+  # only take the lock to create the backend on first use
+  backend = _backend
+  if backend is not None:
+    return backend
   with _backend_lock:
-    backend = _backends.get(FLAGS.jax_xla_backend)
-    if backend is None:
-      msg = 'Unknown jax_xla_backend value "{}".'
-      raise ValueError(msg.format(FLAGS.jax_xla_backend))
-    return backend()
+    if _backend is None:
+      factory = _backends.get(FLAGS.jax_xla_backend)
+      if factory is None:
+        msg = 'Unknown jax_xla_backend value "{}".'
+        raise ValueError(msg.format(FLAGS.jax_xla_backend))
+      _backend = factory()
+    return _backend
 
 
 def device_count():
-  return int(get_backend().device_count())
+  global _device_count
+  # the backend is created once per process, so its device count is fixed
+  if _device_count is None:
+    _device_count = int(get_backend().device_count())
+  return _device_count
+_device_count = None
 
 
 ### utility functions
@@ -153,16 +272,44 @@ _dtype_to_32bit_dtype = {
     onp.dtype('complex128'): onp.dtype('complex64'),
 }
 
+# The same table keyed by dtype.num, an int that is cheaper to hash than a
+# dtype. Several type codes (e.g. 'l' and 'q' on most platforms) name equal
+# dtypes with distinct nums, so we include every type code's num.
+_dtype_num_to_32bit_dtype = {
+    onp.dtype(char).num: _dtype_to_32bit_dtype[onp.dtype(char)]
+    for char in onp.typecodes['All']
+    if onp.dtype(char) in _dtype_to_32bit_dtype}
+
 
-@util.memoize
 def canonicalize_dtype(dtype):
   """Convert from a dtype to a canonical dtype based on FLAGS.jax_enable_x64."""
-  dtype = onp.dtype(dtype)
-
-  if FLAGS.jax_enable_x64:
-    return dtype
+  try:
+    return _canonicalize_dtype_cache[dtype]
+  except KeyError:
+    pass
+  np_dtype = onp.dtype(dtype)
+  if _X64:
+    canonical_dtype = np_dtype
   else:
-    return _dtype_to_32bit_dtype.get(dtype, dtype)
+    canonical_dtype = _dtype_num_to_32bit_dtype.get(np_dtype.num, np_dtype)
+  # cache under both the argument and the dtype it names, since callers pass a
+  # mix of dtypes and scalar types
+  _canonicalize_dtype_cache[dtype] = canonical_dtype
+  _canonicalize_dtype_cache[np_dtype] = canonical_dtype
+  return canonical_dtype
+_canonicalize_dtype_cache = {}
+
+# FLAGS.jax_enable_x64, kept up to date by _update_x64 so that canonicalization
+# doesn't read the flag on every call
+_X64 = bool(FLAGS.jax_enable_x64)
+
+def _update_x64(enabled):
+  global _X64
+  _X64 = bool(enabled)
+  _canonicalize_dtype_cache.clear()
+  dtype_to_etype.cache_clear()
+  supported_numpy_dtypes.cache_clear()
+flags.add_update_hook('jax_enable_x64', _update_x64)
 
 
 @util.memoize
@@ -174,22 +321,31 @@ def supported_numpy_dtypes():
 # TODO(mattjj,frostig): try to remove this function
 def normalize_to_xla_dtypes(val):
   """Normalize dtypes in a value."""
-  if hasattr(val, '__array__') or onp.isscalar(val):
+  if isinstance(val, (tuple, list)):
+    # only recurse into nested containers; normalize leaves directly
+    return tuple(normalize_to_xla_dtypes(x) if isinstance(x, (tuple, list))
+                 else _normalize_leaf_dtype(x) for x in val)
+  return _normalize_leaf_dtype(val)
+
+def _normalize_leaf_dtype(val):
+  if type(val) is onp.ndarray:
+    return onp.asarray(val, dtype=canonicalize_dtype(val.dtype))
+  elif hasattr(val, '__array__') or onp.isscalar(val):
     return onp.asarray(val, dtype=canonicalize_dtype(onp.result_type(val)))
-  elif isinstance(val, (tuple, list)):
-    return tuple(normalize_to_xla_dtypes(x) for x in val)
   raise TypeError('Can\'t convert to XLA: {}'.format(val))
 
 
 # TODO(mattjj,frostig): try to remove this function
 def shape_of(value):
   """Given a Python or XLA value, return its canonicalized XLA Shape."""
-  if hasattr(value, 'shape') and hasattr(value, 'dtype'):
-    return Shape.array_shape(canonicalize_dtype(value.dtype), value.shape)
+  if type(value) is onp.ndarray or (hasattr(value, 'shape') and
+                                    hasattr(value, 'dtype')):
+    return xla_client.Shape.array_shape(canonicalize_dtype(value.dtype),
+                                        value.shape)
+  elif isinstance(value, (tuple, list)):
+    return xla_client.Shape.tuple_shape(tuple(shape_of(elt) for elt in value))
   elif onp.isscalar(value):
     return shape_of(onp.asarray(value))
-  elif isinstance(value, (tuple, list)):
-    return Shape.tuple_shape(tuple(shape_of(elt) for elt in value))
   else:
     raise TypeError('Unexpected type: {}'.format(type(value)))
 
@@ -204,7 +360,15 @@ class _JaxComputationBuilder(xla_client.ComputationBuilder):
   # Method name case follows that of the XLA ComputationBuilder
   # pylint: disable=invalid-name
 
+  def __init__(self, name):
+    super(_JaxComputationBuilder, self).__init__(name)
+    self._const_cache = {}
+    self._subcomputation_cache = {}
+    self._handlers = _constant_handlers
+
   def Build(self, *args, **kwargs):
+    self._const_cache.clear()
+    self._subcomputation_cache.clear()
     return super(_JaxComputationBuilder, self).Build(
         *args, **kwargs)
 
@@ -213,13 +377,32 @@ class _JaxComputationBuilder(xla_client.ComputationBuilder):
         shape_of(value), name=name, parameter_num=parameter_num)
 
   def NumpyArrayConstant(self, value, canonicalize_types=True):
+    key = constant_cache_key(value)
+    if key is not None:
+      key = (canonicalize_types,) + key
+      cached = self._const_cache.get(key)
+      if cached is not None:
+        return cached[1]
+    py_val = value
     if canonicalize_types:
       value = normalize_to_xla_dtypes(value)
-    return super(_JaxComputationBuilder, self).Constant(value)
+    op = super(_JaxComputationBuilder, self).Constant(value)
+    if key is not None:
+      # keep the value alive so that an id-based key can't be reused
+      self._const_cache[key] = (py_val, op)
+    return op
 
   def ConstantLike(self, example_value, value, canonicalize_types=True):
-    example_value = onp.asarray(example_value)
-    return self.Constant(onp.array(value, dtype=example_value.dtype))
+    dtype = getattr(example_value, 'dtype', None)
+    if dtype is None:
+      dtype = onp.asarray(example_value).dtype
+    if canonicalize_types:
+      dtype = canonicalize_dtype(dtype)
+    return self._raw_constant(onp.asarray(value, dtype=dtype))
+
+  def _raw_constant(self, value):
+    # `value` must already be an ndarray with an XLA-compatible dtype
+    return super(_JaxComputationBuilder, self).Constant(value)
 
   def Constant(self, py_val, canonicalize_types=True):
     """Translate constant `py_val` to a constant for this ComputationBuilder.
@@ -231,10 +414,17 @@ class _JaxComputationBuilder(xla_client.ComputationBuilder):
       A representation of the constant, either a ComputationDataHandle or None
     """
     py_type = type(py_val)
-    if py_type in _constant_handlers:
-      return _constant_handlers[py_type](self, py_val, canonicalize_types)
-    else:
-      raise TypeError("No constant handler for type: {}".format(py_type))
+    handler = self._handlers.get(py_type)
+    if handler is None:
+      # fall back to the handler of a registered base class, e.g. for
+      # ndarray subclasses
+      for cls in py_type.__mro__[1:]:
+        handler = self._handlers.get(cls)
+        if handler is not None:
+          break
+      else:
+        raise TypeError("No constant handler for type: {}".format(py_type))
+    return handler(self, py_val, canonicalize_types)
 
   # TODO(mattjj): remove when CrossReplicaSum is added to XLA:CPU
   def CrossReplicaSum(self, operand, replica_groups):
@@ -255,6 +445,18 @@ class _JaxComputationBuilder(xla_client.ComputationBuilder):
           operand, split_axis, concat_axis, replica_groups)
 
 
+def constant_cache_key(value):
+  """Returns a key under which to cache the constant `value`, or None."""
+  if isinstance(value, (onp.ndarray, onp.generic)):
+    # small numpy values are keyed by contents, so mutation can't go unnoticed
+    if value.nbytes <= 64:
+      return (type(value), value.dtype, value.shape, value.tobytes())
+  elif type(value) in _python_scalar_types:
+    return (id(value),)
+  return None
+_python_scalar_types = {bool, int, float, complex}
+
+
 def make_computation_builder(name):
   return _JaxComputationBuilder(name)
 
@@ -269,8 +471,8 @@ def _ndarray_constant_handler(c, val, canonicalize_types=True):
 
   This function essentially calls c.NumpyArrayConstant(val) except it has
   special handling of arrays with any strides of size zero: for those, it
-  generates appropriate calls to NumpyArrayConstant, Broadcast, and Transpose
-  to avoid staging in large literals that might arise from np.zeros or np.ones
+  generates appropriate calls to NumpyArrayConstant and BroadcastInDim to
+  avoid staging in large literals that might arise from np.zeros or np.ones
   or the output of lax.broadcast (which uses onp.broadcast_to which in turn
   uses size-zero strides).
 
@@ -282,17 +484,15 @@ def _ndarray_constant_handler(c, val, canonicalize_types=True):
     An XLA ComputationDataHandle / XlaOp representing the constant ndarray
     staged into the XLA Computation.
   """
-  # TODO(mattjj): revise this to use c.BroadcastInDim rather than Transpose
-  if onp.any(onp.equal(0, val.strides)) and val.size > 0:
-    zero_stride_axes, = onp.where(onp.equal(0, val.strides))
-    other_axes, = onp.where(onp.not_equal(0, val.strides))
-    collapsed_val = val[tuple(0 if ax in zero_stride_axes else slice(None)
-                              for ax in range(val.ndim))]
-    xla_val = c.Broadcast(
+  strides = val.strides
+  if val.size > 0 and any(stride == 0 for stride in strides):
+    other_axes = tuple(i for i, stride in enumerate(strides) if stride != 0)
+    collapsed_val = val[tuple(0 if stride == 0 else slice(None)
+                              for stride in strides)]
+    # the axes of collapsed_val map to the nonzero-stride axes of the output
+    return c.BroadcastInDim(
         c.NumpyArrayConstant(collapsed_val, canonicalize_types),
-        onp.take(val.shape, zero_stride_axes))
-    permutation = onp.argsort(tuple(zero_stride_axes) + tuple(other_axes))
-    return c.Transpose(xla_val, permutation)
+        val.shape, other_axes)
   else:
     return c.NumpyArrayConstant(val, canonicalize_types)
 register_constant_handler(onp.ndarray, _ndarray_constant_handler)
@@ -304,8 +504,26 @@ def _scalar_constant_handler(c, val, canonicalize_types=True):
 for scalar_type in [onp.int8, onp.int16, onp.int32, onp.int64,
                     onp.uint8, onp.uint16, onp.uint32, onp.uint64,
                     onp.float16, onp.float32, onp.float64, onp.float128,
-                    float, int, bool, onp.bool_, onp.longlong]:
+                    onp.bool_, onp.longlong]:
   register_constant_handler(scalar_type, _scalar_constant_handler)
 
-if six.PY2:
-  register_constant_handler(long, _scalar_constant_handler) # noqa: F821
+
+def _python_scalar_constant_handler(dtype, c, val, canonicalize_types=True):
+  # the dtype of a Python scalar is known from its type, so we build the array
+  # directly rather than inferring it with onp.result_type
+  if canonicalize_types:
+    dtype = canonicalize_dtype(dtype)
+  return c.NumpyArrayConstant(onp.asarray(val, dtype=dtype),
+                              canonicalize_types=False)
+
+register_constant_handler(
+    int, partial(_python_scalar_constant_handler, onp.dtype(onp.int64)))
+register_constant_handler(
+    float, partial(_python_scalar_constant_handler, onp.dtype(onp.float64)))
+register_constant_handler(
+    bool, partial(_python_scalar_constant_handler, onp.dtype(onp.bool_)))
+
+try:
+  register_constant_handler(long, _scalar_constant_handler)  # noqa: F821
+except NameError:  # Python 3, where int is already arbitrary-precision
+  pass
@@ -33,6 +33,7 @@ from jax import jit, grad, device_put, jacfwd, jacrev, hessian
 from jax import api, lax
 from jax.core import Primitive
 from jax.interpreters import ad
+from jax.interpreters import xla
 from jax.interpreters.xla import DeviceArray
 from jax.abstract_arrays import concretization_err_msg
 from jax.lib import xla_bridge as xb
@@ -477,6 +478,37 @@ class APITest(jtu.JaxTestCase):
   def test_complex_input_jacfwd_raises_error(self):
     self.assertRaises(TypeError, lambda: jacfwd(lambda x: np.sin(x))(1 + 2j))
 
+  def test_jit_lowers_repeated_inner_jit_once(self):
+    inner = jit(lambda x: np.sin(x) * 2.)
+
+    lowered = []
+    jaxpr_computation = xla.jaxpr_computation
+    def recording_jaxpr_computation(jaxpr, *args):
+      lowered.append(jaxpr)
+      return jaxpr_computation(jaxpr, *args)
+    xla.jaxpr_computation = recording_jaxpr_computation
+    self.addCleanup(setattr, xla, 'jaxpr_computation', jaxpr_computation)
+
+    ans = jit(lambda x: inner(inner(x)))(1.)
+    self.assertAllClose(ans, 2. * onp.sin(2. * onp.sin(1.)), check_dtypes=False)
+    num_inner_lowerings = sum(
+        any(eqn.primitive is lax.sin_p for eqn in jaxpr.eqns)
+        for jaxpr in lowered)
+    self.assertEqual(num_inner_lowerings, 1)
+
+  def test_translation_rule_registered_after_lowering(self):
+    foo_p = Primitive('foo')
+    foo_p.def_abstract_eval(lambda x: x)
+    xla.translations.update({foo_p: lambda c, x: c.Add(x, x)})
+    self.addCleanup(xla.translations.pop, foo_p)
+    self.assertAllClose(jit(lambda x: foo_p.bind(x))(3.), 6.,
+                        check_dtypes=False)
+
+    # replacing the rule after a lowering must not reuse the stale rule
+    xla.translations.update({foo_p: lambda c, x: c.Mul(x, x)})
+    self.assertAllClose(jit(lambda x: foo_p.bind(x))(3.), 9.,
+                        check_dtypes=False)
+
   def test_defvjp_all(self):
     foo_p = Primitive('foo')
     def foo(x): return 2. * foo_p.bind(x)
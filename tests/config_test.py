@@ -0,0 +1,42 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the config module."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+from absl.testing import absltest
+
+from jax import config as jax_config
+
+
+class ConfigTest(absltest.TestCase):
+
+  def testUpdateHookReceivesNewValue(self):
+    config = jax_config.Config()
+    config.DEFINE_integer('some_option', 0, 'An option.')
+    received = []
+    config.add_update_hook('some_option', received.append)
+    config.update('some_option', 3)
+    self.assertEqual(received, [3])
+    self.assertEqual(config.read('some_option'), 3)
+
+  def testUpdateHookRequiresDefinedOption(self):
+    config = jax_config.Config()
+    self.assertRaises(Exception, config.add_update_hook, 'missing', id)
+
+
+if __name__ == '__main__':
+  absltest.main()
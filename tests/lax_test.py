@@ -1476,6 +1476,41 @@ class DeviceConstantTest(jtu.JaxTestCase):
 
     self._CheckDeviceConstant(make_const, expected)
 
+  def testInstantiatedConstantsAreCachedByParameters(self):
+    shape, dtype = (2, 3, 4), onp.float32
+    consts = [lax.full(shape, 0., dtype), lax.full(shape, 1., dtype),
+              lax.broadcasted_iota(dtype, shape, 0),
+              lax.broadcasted_iota(dtype, shape, 2),
+              lax.broadcasted_eye(dtype, shape, (0, 1)),
+              lax.broadcasted_eye(dtype, shape, (1, 2))]
+
+    old_executables = xla._device_constant_executables
+    xla._device_constant_executables = collections.OrderedDict()
+    self.addCleanup(setattr, xla, '_device_constant_executables',
+                    old_executables)
+    compiled = []
+    compile_device_constant = xla._compile_device_constant
+    def recording_compile_device_constant(const, device_num):
+      compiled.append(const)
+      return compile_device_constant(const, device_num)
+    xla._compile_device_constant = recording_compile_device_constant
+    self.addCleanup(setattr, xla, '_compile_device_constant',
+                    compile_device_constant)
+
+    for _ in range(2):
+      for const in consts:
+        buf = xla._instantiate_device_constant(const, cutoff=0)
+        self.assertAllClose(buf.to_py(), onp.asarray(const), check_dtypes=True)
+    self.assertEqual(len(compiled), len(consts))
+
+  def testInstantiateConstantWithCachingDisabled(self):
+    old_size = xla_bridge.COMPILE_CACHE_SIZE
+    xla_bridge.COMPILE_CACHE_SIZE = 0
+    self.addCleanup(setattr, xla_bridge, 'COMPILE_CACHE_SIZE', old_size)
+    const = lax.broadcasted_iota(onp.float32, (2, 3), 1)
+    buf = xla._instantiate_device_constant(const, cutoff=0)
+    self.assertAllClose(buf.to_py(), onp.asarray(const), check_dtypes=True)
+
 
 GradTestSpec = collections.namedtuple(
     "GradTestSpec", ["op", "nargs", "order", "rng", "dtypes", "name", "tol"])
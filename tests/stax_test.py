@@ -66,6 +66,18 @@ class StaxTest(jtu.JaxTestCase):
     out = stax.glorot()(key, shape)
     self.assertEqual(out.shape, shape)
 
+  @parameterized.named_parameters(jtu.cases_from_list(
+      {"testcase_name": "_init={}_shape={}".format(name, shape),
+       "name": name, "value": value, "shape": shape}
+      for name, value in [("zeros", 0.), ("ones", 1.)]
+      for shape in [(2, 3), (5,)]))
+  def testConstantInit(self, name, value, shape):
+    key = random.PRNGKey(0)
+    out = getattr(stax, name)(key, shape)
+    self.assertEqual(out.dtype, onp.float32)
+    self.assertAllClose(out, onp.full(shape, value, onp.float32),
+                        check_dtypes=True)
+
   @parameterized.named_parameters(jtu.cases_from_list(
       {"testcase_name":
        "_channels={}_filter_shape={}_padding={}_strides={}_input_shape={}"
@@ -0,0 +1,240 @@
+# Copyright 2019 Google LLC
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+
+"""Tests for the xla_bridge module."""
+from __future__ import absolute_import
+from __future__ import division
+from __future__ import print_function
+
+import os
+import shutil
+import tempfile
+import warnings
+
+from absl.testing import absltest
+import numpy as onp
+
+from jax import test_util as jtu
+from jax.lib import xla_bridge as xb
+from jax.lib import xla_client
+
+from jax.config import config
+config.parse_flags_with_absl()
+
+
+class _FakeExecutable(object):
+
+  def __init__(self, hlo):
+    self.hlo = hlo
+
+
+class _FakeComputation(object):
+  """Stands in for a built XLA Computation, counting calls to Compile."""
+
+  def __init__(self, hlo):
+    self.hlo = hlo
+    self.num_compiles = 0
+
+  def GetSerializedProto(self):
+    return self.hlo.encode('utf-8')
+
+  def Compile(self, arg_shapes, compile_options, backend=None):
+    self.num_compiles += 1
+    return _FakeExecutable(self.hlo)
+
+
+class _FakeBackend(object):
+  """A backend that can't serialize executables, like those of jaxlib today."""
+  platform = 'fake'
+
+  def __init__(self, num_devices=1):
+    self.num_devices = num_devices
+
+  def device_count(self):
+    return self.num_devices
+
+
+class _FakeSerializingBackend(_FakeBackend):
+
+  def serialize_executable(self, executable):
+    return executable.hlo.encode('utf-8')
+
+  def deserialize_executable(self, serialized, compile_options):
+    hlo = serialized.decode('utf-8')
+    if not hlo.startswith('HloModule'):
+      raise RuntimeError('corrupt executable')
+    return _FakeExecutable(hlo)
+
+
+class CompilationCacheTest(jtu.JaxTestCase):
+
+  def setUp(self):
+    super(CompilationCacheTest, self).setUp()
+    self.cache_dir = tempfile.mkdtemp()
+    self.addCleanup(shutil.rmtree, self.cache_dir)
+    self._set_flag('jax_compilation_cache_dir', self.cache_dir)
+
+  def _set_flag(self, name, value):
+    # FLAGS reads absl's flag values once they have been parsed
+    flag_values = config.absl_flags.FLAGS if config.use_absl else None
+    old_value = getattr(config.FLAGS, name)
+    def set_value(value):
+      config.update(name, value)
+      if flag_values is not None:
+        setattr(flag_values, name, value)
+    set_value(value)
+    self.addCleanup(set_value, old_value)
+
+  def _use_backend(self, backend):
+    old_get_backend = xb.get_backend
+    xb.get_backend = lambda: backend
+    self.addCleanup(setattr, xb, 'get_backend', old_get_backend)
+
+  def _cache_entries(self):
+    return [os.path.join(self.cache_dir, name)
+            for name in os.listdir(self.cache_dir)]
+
+  def testMissCompilesAndWritesEntry(self):
+    self._use_backend(_FakeSerializingBackend())
+    built_c = _FakeComputation('HloModule f')
+    compiled = xb.compile_computation(built_c, ())
+    self.assertEqual(built_c.num_compiles, 1)
+    self.assertEqual(compiled.hlo, 'HloModule f')
+    entries = self._cache_entries()
+    self.assertEqual(len(entries), 1)
+    with open(entries[0], 'rb') as f:
+      self.assertEqual(f.read(), b'HloModule f')
+
+  def testHitLoadsEntryWithoutCompiling(self):
+    self._use_backend(_FakeSerializingBackend())
+    xb.compile_computation(_FakeComputation('HloModule f'), ())
+    built_c = _FakeComputation('HloModule f')
+    compiled = xb.compile_computation(built_c, ())
+    self.assertEqual(built_c.num_compiles, 0)
+    self.assertEqual(compiled.hlo, 'HloModule f')
+
+  def testCorruptEntryIsRecompiledAndOverwritten(self):
+    self._use_backend(_FakeSerializingBackend())
+    xb.compile_computation(_FakeComputation('HloModule f'), ())
+    path, = self._cache_entries()
+    with open(path, 'wb') as f:
+      f.write(b'garbage')
+
+    built_c = _FakeComputation('HloModule f')
+    with warnings.catch_warnings(record=True) as caught:
+      warnings.simplefilter('always')
+      compiled = xb.compile_computation(built_c, ())
+    self.assertEqual(built_c.num_compiles, 1)
+    self.assertEqual(compiled.hlo, 'HloModule f')
+    self.assertTrue(any('recompiling' in str(w.message) for w in caught))
+    with open(path, 'rb') as f:
+      self.assertEqual(f.read(), b'HloModule f')
+
+  def testUnsupportedBackendWarnsOnce(self):
+    self._use_backend(_FakeBackend())
+    old_warned = xb._warned_cache_unsupported
+    xb._warned_cache_unsupported = False
+    self.addCleanup(setattr, xb, '_warned_cache_unsupported', old_warned)
+
+    built_c = _FakeComputation('HloModule f')
+    with warnings.catch_warnings(record=True) as caught:
+      warnings.simplefilter('always')
+      xb.compile_computation(built_c, ())
+      xb.compile_computation(built_c, ())
+    self.assertEqual(built_c.num_compiles, 2)
+    self.assertEqual(len(caught), 1)
+    self.assertIn('jax_compilation_cache_dir', str(caught[0].message))
+    self.assertEqual(self._cache_entries(), [])
+
+  def testKeyDependsOnDeviceSpec(self):
+    built_c = _FakeComputation('HloModule f')
+    def key(backend):
+      return xb._compilation_cache_key(built_c, (), None, None, backend)
+
+    other_platform = _FakeSerializingBackend()
+    other_platform.platform = 'other'
+    self.assertEqual(key(_FakeSerializingBackend()),
+                     key(_FakeSerializingBackend()))
+    self.assertNotEqual(key(_FakeSerializingBackend()), key(other_platform))
+    self.assertNotEqual(key(_FakeSerializingBackend(num_devices=1)),
+                        key(_FakeSerializingBackend(num_devices=2)))
+
+  def testKeyDependsOnLargeConstants(self):
+    # HLO text prints constants with more than 10 elements as {...}
+    def build(value):
+      c = xb.make_computation_builder('constant')
+      c.Constant(value)
+      return c.Build()
+    x = onp.arange(16, dtype=onp.float32)
+    backend = _FakeSerializingBackend()
+    self.assertNotEqual(
+        xb._compilation_cache_key(build(x), (), None, None, backend),
+        xb._compilation_cache_key(build(x + 1), (), None, None, backend))
+
+
+class CanonicalizeDtypeTest(jtu.JaxTestCase):
+
+  def testEnableX64UpdateInvalidatesCache(self):
+    self.addCleanup(config.update, 'jax_enable_x64',
+                    config.read('jax_enable_x64'))
+    config.update('jax_enable_x64', True)
+    self.assertEqual(xb.canonicalize_dtype(onp.float64), onp.float64)
+    config.update('jax_enable_x64', False)
+    self.assertEqual(xb.canonicalize_dtype(onp.float64), onp.float32)
+    config.update('jax_enable_x64', True)
+    self.assertEqual(xb.canonicalize_dtype(onp.float64), onp.float64)
+
+
+class ShapeOfTest(jtu.JaxTestCase):
+
+  def testNdarray(self):
+    x = onp.zeros((2, 3), onp.float32)
+    self.assertEqual(xb.shape_of(x),
+                     xla_client.Shape.array_shape(onp.dtype(onp.float32),
+                                                  (2, 3)))
+
+  def testPythonScalar(self):
+    self.assertEqual(
+        xb.shape_of(1.5),
+        xla_client.Shape.array_shape(xb.canonicalize_dtype(onp.float64), ()))
+
+  def testNestedTuple(self):
+    x = onp.zeros(4, onp.int32)
+    array_shape = xla_client.Shape.array_shape
+    expected = xla_client.Shape.tuple_shape((
+        array_shape(onp.dtype(onp.int32), (4,)),
+        xla_client.Shape.tuple_shape((
+            array_shape(xb.canonicalize_dtype(onp.bool_), ()),
+            array_shape(onp.dtype(onp.int32), (4,))))))
+    self.assertEqual(xb.shape_of((x, (True, x))), expected)
+
+
+class _NdarraySubclass(onp.ndarray):
+  pass
+
+
+class ConstantTest(jtu.JaxTestCase):
+
+  def testNdarraySubclassUsesNdarrayHandler(self):
+    x = onp.arange(6, dtype=onp.float32).reshape(2, 3).view(_NdarraySubclass)
+    self.assertNotIn(_NdarraySubclass, xb._constant_handlers)
+    c = xb.make_computation_builder('constant')
+    c.Constant(x)
+    compiled = xb.compile_computation(c.Build(), ())
+    self.assertAllClose(compiled.Execute(()).to_py(), onp.asarray(x),
+                        check_dtypes=True)
+
+
+if __name__ == '__main__':
+  absltest.main()